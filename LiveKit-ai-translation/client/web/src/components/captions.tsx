@@ -1,5 +1,5 @@
 import { useRoomContext } from "@livekit/components-react";
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import {
   TranscriptionSegment,
   RoomEvent,
@@ -22,6 +22,11 @@ export default function Captions() {
     [language: string]: string;
   }>({});
 
+  // Segment currently shown in each language's buffer
+  const shownSegments = useRef<{
+    [language: string]: { id: string; final: boolean };
+  }>({});
+
   useEffect(() => {
     console.log("🎯 CAPTIONS COMPONENT MOUNTED:", {
       isHost: state.isHost,
@@ -79,9 +84,16 @@ export default function Captions() {
           let { language, text } = segment;
           if (language === "") language = "ar";  // Default to Arabic as that's our source language
           
+          const shown = shownSegments.current[language];
+          
           // Build complete sentences by accumulating text
           if (!newBuffers[language]) {
             newBuffers[language] = text;
+            shownSegments.current[language] = { id: segment.id, final: segment.final };
+          } else if (shown && (shown.id === segment.id || shown.final)) {
+            // Interim/final update of the shown segment, or the start of the next one
+            newBuffers[language] = text.trim();
+            shownSegments.current[language] = { id: segment.id, final: segment.final };
           } else {
             // Check if this looks like a continuation or new sentence
             const trimmedText = text.trim();
@@ -90,9 +102,11 @@ export default function Captions() {
             if (trimmedText.endsWith('.') || trimmedText.endsWith('?') || trimmedText.endsWith('!')) {
               // Complete sentence - replace buffer
               newBuffers[language] = trimmedText;
+              shownSegments.current[language] = { id: segment.id, final: segment.final };
             } else if (currentBuffer.length === 0 || trimmedText.length > currentBuffer.length) {
               // Growing sentence - update buffer
               newBuffers[language] = trimmedText;
+              shownSegments.current[language] = { id: segment.id, final: segment.final };
             }
           }
         }
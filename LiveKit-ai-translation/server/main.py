@@ -9,6 +9,7 @@ import json
 import time
 import re
 from typing import Set, Any, Dict, Optional
+from collections import deque
 from enum import Enum
 from dataclasses import dataclass
 from datetime import datetime
@@ -27,16 +28,27 @@ from livekit.agents import (
 )
 from livekit.plugins import openai, silero, speechmatics
 from livekit.plugins.speechmatics.types import TranscriptionConfig
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from cachetools import LRUCache
+import httpx
 import os
 
 # Import our Supabase service
-from supabase_service import supabase_service
+from supabase_service import supabase_service, create_logger_http_client
 
 load_dotenv()
 
 logger = logging.getLogger("transcriber")
 
+# Use uvloop's faster event loop where available (it doesn't support Windows). Set at import
+# time so job processes, which import this module without running __main__, get it too.
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 @dataclass
 class Language:
     code: str
@@ -62,6 +74,40 @@ LanguageCode = Enum(
     {lang.name: code for code, lang in languages.items()},
 )
 
+# Response for the get/languages RPC; the language table never changes at runtime
+LANGUAGES_JSON = json.dumps([
+    {"code": lang.code, "name": lang.name, "flag": lang.flag}
+    for lang in languages.values()
+])
+
+# Text up to and including a sentence ending (Arabic and Latin punctuation)
+SENTENCE_PATTERN = re.compile(r"[^۔؟!.?]*[۔؟!.?]")
+
+# Whitespace, punctuation, Arabic diacritics and tatweel, ignored when comparing sentences
+NORMALIZE_PATTERN = re.compile(r"[\W_\u0640]+")
+
+# How long a sentence from one final suppresses the same sentence in later finals, in
+# seconds; slightly above the STT max_delay, so only overlapping finals are deduplicated
+DUPLICATE_WINDOW_SECONDS = 3.0
+
+# Audio frames buffered between the track and STT before the oldest are dropped
+FRAME_QUEUE_SIZE = 50
+
+# Quiet period after the last join/leave before the participant count is sent, in seconds
+PARTICIPANT_COUNT_DEBOUNCE = 0.2
+
+# Recent translations keyed by (source_language, target_language, text);
+# recitations and set phrases repeat often enough to skip the LLM on a hit
+translation_cache: LRUCache = LRUCache(maxsize=512)
+
+# Minimum time between interim (non-final) translation updates, in seconds
+PARTIAL_PUBLISH_INTERVAL = 0.1
+
+
+def sentence_fingerprint(text: str) -> int:
+    """Hash of a sentence that ignores whitespace, punctuation and diacritics"""
+    return hash(NORMALIZE_PATTERN.sub("", text).casefold())
+
 
 class TranslationService:
     """Enhanced translation service with Supabase integration"""
@@ -71,9 +117,8 @@ class TranslationService:
         self.target_language = target_language
         self.source_language = source_language
         self.use_context = True  # Enable context for better translations
-        self.context = llm.ChatContext()
-        self.message_count = 0
-        self.max_context_messages = 9
+        # Sliding window of recent (source, translation) turns sent as context
+        self.recent_turns: deque[tuple[str, str]] = deque(maxlen=4)
         
         # Configure system prompt
         self.system_prompt = (
@@ -86,62 +131,139 @@ class TranslationService:
             f"5) Maintain the tone and meaning of the original."
         )
         
-        self.context.add_message(role="system", content=self.system_prompt)
-        self.llm = openai.LLM()
+        # HTTP/2 keep-alive client so concurrent translations share one connection. Retry,
+        # timeout and pool settings match the plugin's default client; livekit's conn_options
+        # handle retries, so the OpenAI SDK must not retry as well
+        self.llm = openai.LLM(
+            client=AsyncOpenAI(
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    http2=True,
+                    timeout=httpx.Timeout(connect=15.0, read=5.0, write=5.0, pool=5.0),
+                    follow_redirects=True,
+                    limits=httpx.Limits(
+                        max_connections=50, max_keepalive_connections=50, keepalive_expiry=120
+                    ),
+                )
+            )
+        )
         
         logger.info(f"Translation service initialized: {source_language} -> {target_language}")
 
-    async def translate_text(self, text: str, track: rtc.Track) -> str:
-        """Translate text and publish to room"""
+    async def translate_texts(self, texts: list[str], track: rtc.Track) -> list[str]:
+        """Translate sentences concurrently, publishing them to the room in input order"""
+        published = [asyncio.Event() for _ in texts]
+        
+        async def translate_in_turn(index: int, text: str) -> str:
+            try:
+                previous = published[index - 1] if index else None
+                return await self.translate_text(text, track, after=previous)
+            finally:
+                published[index].set()
+        
+        return list(await asyncio.gather(*(
+            translate_in_turn(index, text) for index, text in enumerate(texts)
+        )))
+
+    async def translate_text(
+        self,
+        text: str,
+        track: rtc.Track,
+        after: Optional[asyncio.Event] = None,
+    ) -> str:
+        """Translate text and publish to room
+
+        If `after` is given, the LLM call starts right away but interim updates, the final
+        segment and the context turn wait until that event is set by the previous sentence.
+        """
+        # Interim state, so a failed stream can still close its on-screen segment
+        segment_id = utils.misc.shortuuid("SG_")
+        translated_text = ""
+        published_partial = False
         try:
-            if self.use_context:
-                self.context.add_message(content=text, role="user")
-                self.message_count += 1
-                
-                # Reset context periodically to prevent drift
-                if self.message_count > self.max_context_messages:
-                    self.context = llm.ChatContext()
-                    self.context.add_message(role="system", content=self.system_prompt)
-                    self.message_count = 0
-                    logger.debug("Context reset after 9 messages")
-                
-                stream = self.llm.chat(chat_ctx=self.context)
-            else:
-                # Fresh context mode
-                fresh_context = llm.ChatContext()
-                fresh_context.add_message(role="system", content=self.system_prompt)
-                fresh_context.add_message(content=text, role="user")
-                stream = self.llm.chat(chat_ctx=fresh_context)
+            cache_key = (self.source_language, self.target_language, text)
+            cached_translation = translation_cache.get(cache_key)
+            if cached_translation is not None:
+                if after:
+                    await after.wait()
+                self._remember_turn(text, cached_translation)
+                await self._publish_transcription(cached_translation, track)
+                logger.info(f"Translated (cached): {text[:50]}... -> {cached_translation[:50]}...")
+                return cached_translation
             
-            # Collect translation
-            translated_text = ""
+            stream = self.llm.chat(chat_ctx=self._build_context(text))
+            
+            # Collect translation, publishing interim updates under one segment id
+            last_publish = 0.0
             async for chunk in stream:
                 if chunk.delta and chunk.delta.content:
                     translated_text += chunk.delta.content
+                    
+                    # Only stream interim updates once earlier sentences are on screen
+                    now = time.monotonic()
+                    in_turn = after is None or after.is_set()
+                    if in_turn and now - last_publish >= PARTIAL_PUBLISH_INTERVAL:
+                        await self._publish_transcription(
+                            translated_text.strip(), track, segment_id=segment_id, final=False
+                        )
+                        last_publish = now
+                        published_partial = True
             
             # Clean up translation
             translated_text = translated_text.strip()
+            if after:
+                await after.wait()
+            if translated_text:
+                translation_cache[cache_key] = translated_text
+                self._remember_turn(text, translated_text)
             
-            # Publish to room
-            await self._publish_transcription(translated_text, track)
+            # Publish final translation to room
+            await self._publish_transcription(translated_text, track, segment_id=segment_id)
             
             logger.info(f"Translated: {text[:50]}... -> {translated_text[:50]}...")
             return translated_text
             
         except Exception as e:
             logger.error(f"Translation error: {e}")
+            if published_partial:
+                # Finalize the interim segment so clients don't keep a stale partial caption
+                await self._publish_transcription(translated_text.strip(), track, segment_id=segment_id)
             return text  # Return original text if translation fails
 
-    async def _publish_transcription(self, text: str, track: rtc.Track):
+    def _build_context(self, text: str) -> llm.ChatContext:
+        """Build chat context from the system prompt, recent turns and the new sentence"""
+        chat_ctx = llm.ChatContext()
+        chat_ctx.add_message(role="system", content=self.system_prompt)
+        
+        if self.use_context:
+            for source_text, translation in self.recent_turns:
+                chat_ctx.add_message(role="user", content=source_text)
+                chat_ctx.add_message(role="assistant", content=translation)
+        
+        chat_ctx.add_message(role="user", content=text)
+        return chat_ctx
+
+    def _remember_turn(self, text: str, translation: str):
+        """Add a translated sentence to the sliding context window"""
+        if self.use_context:
+            self.recent_turns.append((text, translation))
+
+    async def _publish_transcription(
+        self,
+        text: str,
+        track: rtc.Track,
+        segment_id: Optional[str] = None,
+        final: bool = True,
+    ):
         """Publish transcription to LiveKit room"""
         try:
             segment = rtc.TranscriptionSegment(
-                id=utils.misc.shortuuid("SG_"),
+                id=segment_id or utils.misc.shortuuid("SG_"),
                 text=text,
                 start_time=0,
                 end_time=0,
                 language=self.target_language,
-                final=True,
+                final=final,
             )
             
             transcription = rtc.Transcription(
@@ -165,6 +287,10 @@ class RoomSessionManager:
         self.active_session: Optional[Dict[str, Any]] = None
         self.translation_service: Optional[TranslationService] = None
         self.participant_count = 0
+        self._pending_count = 0
+        self._debounce_task: Optional[asyncio.Task] = None
+        # HTTP client for admin panel updates, created on first use and closed when the job ends
+        self.http_client: Optional[httpx.AsyncClient] = None
         
     async def initialize(self):
         """Initialize room session by loading room data from database"""
@@ -237,8 +363,8 @@ class RoomSessionManager:
         except Exception as e:
             logger.error(f"Error stopping session: {e}")
 
-    async def handle_transcription(self, text: str, track: rtc.Track):
-        """Handle incoming transcription and translation"""
+    async def handle_transcriptions(self, sentences: list[str], track: rtc.Track):
+        """Translate a batch of sentences concurrently and log them in order"""
         try:
             if not self.translation_service or not self.active_session or not self.room_data:
                 logger.warning("Translation service, session, or room data not initialized")
@@ -249,42 +375,60 @@ class RoomSessionManager:
                 logger.debug("Logging disabled for this session")
                 return
             
-            # Translate text
-            translated_text = await self.translation_service.translate_text(text, track)
-            
-            # Save to database
-            await supabase_service.save_transcript(
-                room_id=self.room_data['id'],
-                session_id=self.active_session['id'],
-                arabic_text=text,
-                translation=translated_text
-            )
+            # Translate all sentences concurrently; results and captions keep input order
+            translations = await self.translation_service.translate_texts(sentences, track)
             
-            # Send to admin panel via WebSocket
-            await supabase_service.send_to_websocket_logger(
-                room_id=self.room_data['id'],
-                mosque_id=self.room_data['mosque_id'],
-                arabic_text=text,
-                translation=translated_text
-            )
+            # Save to database; the admin panel receives new rows via Supabase Realtime
+            for text, translated_text in zip(sentences, translations):
+                await supabase_service.save_transcript(
+                    room_id=self.room_data['id'],
+                    session_id=self.active_session['id'],
+                    arabic_text=text,
+                    translation=translated_text
+                )
             
         except Exception as e:
             logger.error(f"Error handling transcription: {e}")
 
+    def schedule_participant_count_update(self, count: int):
+        """Send the participant count once joins/leaves have settled"""
+        self._pending_count = count
+        if self._debounce_task and not self._debounce_task.done():
+            self._debounce_task.cancel()
+        self._debounce_task = asyncio.create_task(self._send_participant_count_later())
+
+    async def _send_participant_count_later(self):
+        """Wait for the debounce period, then send the latest count"""
+        await asyncio.sleep(PARTICIPANT_COUNT_DEBOUNCE)
+        await self.update_participant_count(self._pending_count)
+
     async def update_participant_count(self, count: int):
         """Update participant count"""
         try:
             if self.room_data:
                 self.participant_count = count
+                if self.http_client is None:
+                    self.http_client = create_logger_http_client()
                 await supabase_service.update_participant_count(
                     room_id=self.room_data['id'],
                     mosque_id=self.room_data['mosque_id'],
-                    count=count
+                    count=count,
+                    http_client=self.http_client
                 )
                 
         except Exception as e:
             logger.error(f"Error updating participant count: {e}")
 
+    async def aclose(self):
+        """Release resources held for this room"""
+        # Transcripts from translations that finished after stop_session are still buffered
+        await supabase_service.drain_transcripts()
+        
+        if self._debounce_task and not self._debounce_task.done():
+            self._debounce_task.cancel()
+        if self.http_client:
+            await self.http_client.aclose()
+
 
 def prewarm(proc: JobProcess):
     """Prewarm function to initialize VAD"""
@@ -330,51 +474,70 @@ async def entrypoint(job: JobContext):
         if not text or len(text.strip()) < 3:
             return []
         
-        # Arabic sentence endings
-        arabic_endings = ['۔', '؟', '!', '.', '?']
-        
         sentences = []
-        current_sentence = ""
+        last_end = 0
         
-        for char in text:
-            current_sentence += char
-            if char in arabic_endings:
-                sentence = current_sentence.strip()
-                if len(sentence) > 5:  # Minimum sentence length
-                    sentences.append(sentence)
-                current_sentence = ""
+        for match in SENTENCE_PATTERN.finditer(text):
+            sentence = match.group(0).strip()
+            if len(sentence) > 5:  # Minimum sentence length
+                sentences.append(sentence)
+            last_end = match.end()
         
         # Add remaining text if substantial
-        if len(current_sentence.strip()) > 10:
-            sentences.append(current_sentence.strip())
+        remainder = text[last_end:].strip()
+        if len(remainder) > 10:
+            sentences.append(remainder)
         
         return sentences
     
     async def transcribe_track(participant: rtc.RemoteParticipant, track: rtc.Track):
         """Transcribe audio track"""
+        feed_task: Optional[asyncio.Task] = None
         try:
             audio_stream = rtc.AudioStream(track)
             stt_stream = stt_provider.stream()
+            frame_queue: asyncio.Queue[rtc.AudioFrame] = asyncio.Queue(maxsize=FRAME_QUEUE_SIZE)
             
             async def process_stt_stream():
                 """Process STT stream and handle translations"""
-                last_transcript = ""
+                # Fingerprints of sentences from recent finals and when they were seen
+                recent_sentences: Dict[int, float] = {}
                 
                 async for event in stt_stream:
                     if event.type == stt.SpeechEventType.FINAL_TRANSCRIPT:
                         text = event.alternatives[0].text.strip()
                         
-                        if text and text != last_transcript:
+                        if text:
                             logger.info(f"📝 Final transcript: {text}")
-                            last_transcript = text
                             
-                            # Extract complete sentences
-                            sentences = extract_complete_sentences(text)
+                            now = time.monotonic()
+                            recent_sentences = {
+                                fingerprint: seen for fingerprint, seen in recent_sentences.items()
+                                if now - seen < DUPLICATE_WINDOW_SECONDS
+                            }
                             
-                            # Process each sentence
-                            for sentence in sentences:
-                                if len(sentence) > 5:
-                                    await session_manager.handle_transcription(sentence, track)
+                            # Extract complete sentences, skipping ones an overlapping earlier
+                            # final already handled; repeats within this final are kept
+                            sentences = []
+                            fingerprints = []
+                            for sentence in extract_complete_sentences(text):
+                                if len(sentence) <= 5:
+                                    continue
+                                
+                                fingerprint = sentence_fingerprint(sentence)
+                                if fingerprint in recent_sentences:
+                                    logger.debug(f"Skipping repeated sentence: {sentence[:50]}...")
+                                    continue
+                                
+                                fingerprints.append(fingerprint)
+                                sentences.append(sentence)
+                            
+                            for fingerprint in fingerprints:
+                                recent_sentences[fingerprint] = now
+                            
+                            # Translate all sentences of this transcript together
+                            if sentences:
+                                await session_manager.handle_transcriptions(sentences, track)
                     
                     elif event.type == stt.SpeechEventType.INTERIM_TRANSCRIPT:
                         # Log interim results for debugging
@@ -382,16 +545,42 @@ async def entrypoint(job: JobContext):
                         if text:
                             logger.debug(f"📝 Interim: {text[:50]}...")
             
+            async def feed_stt_stream():
+                """Push queued audio frames to STT"""
+                while True:
+                    frame = await frame_queue.get()
+                    stt_stream.push_frame(frame)
+                    frame_queue.task_done()
+            
             # Start processing
             asyncio.create_task(process_stt_stream())
+            feed_task = asyncio.create_task(feed_stt_stream())
+            
+            # Stream audio to STT through a bounded queue so ingest never waits on STT
+            async for event in audio_stream:
+                if feed_task.done():
+                    # Surface a failed STT feed instead of queueing frames nobody reads
+                    feed_task.result()
+                
+                if frame_queue.full():
+                    # Drop the oldest frame to keep the most recent audio
+                    frame_queue.get_nowait()
+                    frame_queue.task_done()
+                    logger.debug("Audio frame queue full, dropped oldest frame")
+                frame_queue.put_nowait(event.frame)
             
-            # Stream audio to STT
-            async for frame in audio_stream:
-                stt_stream.push_frame(frame.frame)
+            # Let queued frames reach STT, unless the feed task fails first
+            drain_task = asyncio.create_task(frame_queue.join())
+            await asyncio.wait({drain_task, feed_task}, return_when=asyncio.FIRST_COMPLETED)
+            drain_task.cancel()
+            if feed_task.done():
+                feed_task.result()
                 
         except Exception as e:
             logger.error(f"Error in transcribe_track: {e}")
         finally:
+            if feed_task:
+                feed_task.cancel()
             await stt_stream.aclose()
 
     # Room event handlers
@@ -410,23 +599,20 @@ async def entrypoint(job: JobContext):
         logger.info(f"👤 Participant connected: {participant.identity}")
         # Update participant count
         count = len(job.room.remote_participants) + 1  # +1 for local participant
-        asyncio.create_task(session_manager.update_participant_count(count))
+        session_manager.schedule_participant_count_update(count)
 
     @job.room.on("participant_disconnected")
     def on_participant_disconnected(participant: rtc.RemoteParticipant):
         logger.info(f"👤 Participant disconnected: {participant.identity}")
         # Update participant count
         count = len(job.room.remote_participants)
-        asyncio.create_task(session_manager.update_participant_count(count))
+        session_manager.schedule_participant_count_update(count)
 
     # RPC method for getting supported languages
     @job.room.local_participant.register_rpc_method("get/languages")
     async def get_languages(data: rtc.RpcInvocationData):
         """Return supported languages"""
-        return json.dumps([
-            {"code": lang.code, "name": lang.name, "flag": lang.flag}
-            for lang in languages.values()
-        ])
+        return LANGUAGES_JSON
 
     logger.info("🚀 LiveKit agent fully initialized and ready")
     
@@ -437,6 +623,7 @@ async def entrypoint(job: JobContext):
         logger.info("🛑 Agent stopped by user")
     finally:
         await session_manager.stop_session()
+        await session_manager.aclose()
 
 
 async def request_fnc(req: JobRequest):
@@ -0,0 +1,51 @@
+-- Database setup used by the LiveKit agent: functions called through supabase.rpc(...)
+-- and Realtime configuration. Apply in the Supabase SQL editor (or via a migration)
+-- before deploying the agent.
+
+-- Atomically add `delta` to a session's transcript count and return the new value
+CREATE OR REPLACE FUNCTION increment_transcript_count(sid uuid, delta int)
+RETURNS int
+LANGUAGE sql
+AS $$
+    UPDATE room_sessions
+    SET transcript_count = COALESCE(transcript_count, 0) + delta,
+        updated_at = now()
+    WHERE id = sid
+    RETURNING transcript_count;
+$$;
+
+-- Broadcast new transcripts over Supabase Realtime so the admin panel can subscribe with
+-- supabase.channel(...).on('postgres_changes', { event: 'INSERT', table: 'transcripts',
+-- filter: 'room_id=eq.<id>' }, ...) instead of receiving a separate HTTP push per sentence
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_publication_tables
+        WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = 'transcripts'
+    ) THEN
+        ALTER PUBLICATION supabase_realtime ADD TABLE transcripts;
+    END IF;
+END
+$$;
+
+-- Indexes for the agent's room lookup by LiveKit name and its active-session lookup
+CREATE UNIQUE INDEX IF NOT EXISTS rooms_livekit_room_name_key
+    ON rooms ("Livekit_room_name");
+CREATE INDEX IF NOT EXISTS room_sessions_active_room_id_idx
+    ON room_sessions (room_id) WHERE status = 'active';
+
+-- Per-row key generated by the agent so retried transcript inserts don't create duplicates
+ALTER TABLE transcripts ADD COLUMN IF NOT EXISTS idempotency_key text;
+CREATE UNIQUE INDEX IF NOT EXISTS transcripts_idempotency_key_key
+    ON transcripts (idempotency_key);
+
+-- A room's transcription and translation languages, falling back to Arabic -> English
+CREATE OR REPLACE FUNCTION room_languages(rid int)
+RETURNS TABLE(src text, tgt text)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(transcription_language, 'ar'), COALESCE(translation__language, 'en')
+    FROM rooms
+    WHERE id = rid;
+$$;
@@ -7,16 +7,86 @@ import os
 import asyncio
 import json
 import logging
+import random
+import time
+import uuid
+from functools import lru_cache
 from typing import Optional, Dict, Any, List
-from datetime import datetime
+from datetime import datetime, timezone
 from supabase import create_client
+from postgrest.exceptions import APIError
 from dotenv import load_dotenv
+from cachetools import TTLCache
 import httpx
 
 load_dotenv()
 
 logger = logging.getLogger("supabase_service")
 
+# How long room languages and logging flags are served from memory
+CACHE_TTL_SECONDS = 30
+
+# Transcripts are buffered and written in one multi-row insert
+TRANSCRIPT_BATCH_SIZE = 100
+TRANSCRIPT_FLUSH_INTERVAL = 0.25  # seconds
+
+# Columns the agent reads from rooms and room_sessions
+ROOM_COLUMNS = "id, mosque_id, Title, transcription_language, translation__language"
+SESSION_COLUMNS = "id, logging_enabled"
+
+# Retry policy for transient failures on writes
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.1  # seconds, doubled after each attempt
+# PostgREST codes for failing to reach the database or get a pool connection
+PGRST_CONNECTION_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003"}
+# postgrest-py uses the HTTP status as the error code when the body isn't JSON
+RETRYABLE_STATUS_CODES = {"429", "500", "502", "503", "504"}
+# Transport errors raised before the request reached the server
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+@lru_cache(maxsize=1)
+def _timestamp_prefix(second: int) -> str:
+    """ISO-8601 UTC timestamp up to the whole second, formatted once per second"""
+    return datetime.fromtimestamp(second, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def utc_timestamp() -> str:
+    """Current UTC time as an ISO-8601 string with microseconds"""
+    now = time.time()
+    second = int(now)
+    return f"{_timestamp_prefix(second)}.{int((now - second) * 1_000_000):06d}"
+
+
+def create_logger_http_client() -> httpx.AsyncClient:
+    """Pooled keep-alive HTTP client for WebSocket logger calls, owned by one job"""
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=5.0,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+    )
+
+
+def is_transient_error(error: Exception, idempotent: bool = True) -> bool:
+    """Whether a failed Supabase request is worth retrying
+
+    Non-idempotent requests are only retried when the server cannot have run them.
+    """
+    if isinstance(error, CONNECT_ERRORS):
+        return True
+    if isinstance(error, APIError) and error.code in PGRST_CONNECTION_CODES:
+        return True
+    if not idempotent:
+        return False
+    if isinstance(error, httpx.TransportError):
+        return True
+    if isinstance(error, APIError):
+        if error.code is None:
+            # JSON errors without a PostgREST code come from the API gateway (e.g. rate limits)
+            return True
+        return str(error.code) in PGRST_CONNECTION_CODES | RETRYABLE_STATUS_CODES
+    return False
+
 
 class SupabaseService:
     """Service for handling Supabase database operations and admin panel integration"""
@@ -30,14 +100,40 @@ class SupabaseService:
             raise ValueError("Missing required Supabase environment variables")
             
         self.supabase = create_client(self.supabase_url, self.supabase_key)
+
         self.active_sessions: Dict[str, Dict[str, Any]] = {}
         
+        # Per-room caches to avoid a database round-trip on every transcript
+        self._logging_enabled_cache: TTLCache = TTLCache(maxsize=128, ttl=CACHE_TTL_SECONDS)
+        self._room_languages_cache: TTLCache = TTLCache(maxsize=128, ttl=CACHE_TTL_SECONDS)
+        
+        # Pending transcript rows and the timer that flushes them
+        self._transcript_buffer: List[Dict[str, Any]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        
         logger.info(f"Supabase service initialized with URL: {self.supabase_url}")
 
+    async def _execute(self, query):
+        """Run a blocking supabase-py query in a worker thread to keep the event loop free"""
+        return await asyncio.to_thread(query.execute)
+
+    async def _execute_with_retry(self, query, idempotent: bool = True):
+        """Run a query, retrying rate limits, server errors and dropped connections with backoff"""
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                return await self._execute(query)
+            except Exception as e:
+                if not is_transient_error(e, idempotent) or attempt == RETRY_ATTEMPTS - 1:
+                    raise
+                
+                delay = RETRY_BASE_DELAY * 2 ** attempt + random.uniform(0, 0.05)
+                logger.warning(f"Supabase request failed ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
     async def get_room_by_livekit_name(self, livekit_room_name: str) -> Optional[Dict[str, Any]]:
         """Get room details by LiveKit room name"""
         try:
-            result = self.supabase.table("rooms").select("*").eq("Livekit_room_name", livekit_room_name).execute()
+            result = await self._execute(self.supabase.table("rooms").select(ROOM_COLUMNS).eq("Livekit_room_name", livekit_room_name))
             
             if result.data:
                 return result.data[0]
@@ -48,20 +144,19 @@ class SupabaseService:
             return None
 
     async def get_active_session(self, room_id: int) -> Optional[Dict[str, Any]]:
-        """Get active session for a room"""
-        try:
-            result = self.supabase.table("room_sessions").select("*").eq("room_id", room_id).eq("status", "active").execute()
-            
-            if result.data:
-                return result.data[0]
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error fetching active session for room {room_id}: {e}")
-            return None
+        """Get active session for a room, or None if there is none
+
+        Query errors are raised so callers don't mistake a failed lookup for "no session".
+        """
+        result = await self._execute(self.supabase.table("room_sessions").select(SESSION_COLUMNS).eq("room_id", room_id).eq("status", "active"))
+        
+        if result.data:
+            return result.data[0]
+        return None
 
     async def start_session(self, room_id: int, mosque_id: int) -> Optional[str]:
         """Start a new recording session"""
+        self._logging_enabled_cache.pop(room_id, None)
         try:
             # Check if there's already an active session
             active_session = await self.get_active_session(room_id)
@@ -78,7 +173,7 @@ class SupabaseService:
                 "transcript_count": 0
             }
             
-            result = self.supabase.table("room_sessions").insert(session_data).execute()
+            result = await self._execute(self.supabase.table("room_sessions").insert(session_data))
             
             if result.data:
                 session_id = result.data[0]["id"]
@@ -93,7 +188,11 @@ class SupabaseService:
 
     async def stop_session(self, room_id: int) -> bool:
         """Stop active session for a room"""
+        self._logging_enabled_cache.pop(room_id, None)
         try:
+            # Write out any buffered transcripts before closing the session
+            await self.drain_transcripts()
+            
             # Get active session
             active_session = await self.get_active_session(room_id)
             if not active_session:
@@ -101,11 +200,11 @@ class SupabaseService:
                 return False
             
             # Update session status
-            result = self.supabase.table("room_sessions").update({
+            result = await self._execute(self.supabase.table("room_sessions").update({
                 "status": "completed",
-                "ended_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat()
-            }).eq("id", active_session["id"]).execute()
+                "ended_at": utc_timestamp(),
+                "updated_at": utc_timestamp()
+            }).eq("id", active_session["id"]))
             
             if result.data:
                 logger.info(f"Stopped session {active_session['id']} for room {room_id}")
@@ -117,94 +216,96 @@ class SupabaseService:
             logger.error(f"Error stopping session for room {room_id}: {e}")
             return False
 
-    async def save_transcript(self, room_id: int, session_id: str, arabic_text: str, translation: str) -> bool:
-        """Save transcript to database"""
+    async def save_transcript(self, room_id: int, session_id: str, arabic_text: str, translation: str):
+        """Queue transcript for the next batched database insert (not yet persisted on return)"""
+        transcript_data = {
+            "room_id": room_id,
+            "session_id": session_id,
+            "transcription_segment": arabic_text,
+            "translation_segment": translation,
+            "timestamp": utc_timestamp(),
+            # Lets a retried insert skip rows that were already written
+            "idempotency_key": uuid.uuid4().hex
+        }
+        self._transcript_buffer.append(transcript_data)
+        
+        if len(self._transcript_buffer) >= TRANSCRIPT_BATCH_SIZE:
+            await self.flush_transcripts()
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_transcripts_later())
+
+    async def _flush_transcripts_later(self):
+        """Flush buffered transcripts after the batching interval"""
+        await asyncio.sleep(TRANSCRIPT_FLUSH_INTERVAL)
+        await self.flush_transcripts()
+
+    async def drain_transcripts(self):
+        """Wait for a scheduled flush, then write anything still buffered"""
+        flush_task = self._flush_task
+        if flush_task and not flush_task.done() and flush_task.get_loop() is asyncio.get_running_loop():
+            await flush_task
+        await self.flush_transcripts()
+
+    async def flush_transcripts(self) -> bool:
+        """Insert all buffered transcripts in a single request"""
+        if not self._transcript_buffer:
+            return True
+        
+        batch = self._transcript_buffer
+        self._transcript_buffer = []
+        
         try:
-            transcript_data = {
-                "room_id": room_id,
-                "session_id": session_id,
-                "transcription_segment": arabic_text,
-                "translation_segment": translation,
-                "timestamp": datetime.utcnow().isoformat()
-            }
+            await self._execute_with_retry(
+                self.supabase.table("transcripts").upsert(
+                    batch, on_conflict="idempotency_key", ignore_duplicates=True
+                )
+            )
             
-            result = self.supabase.table("transcripts").insert(transcript_data).execute()
+            # Update transcript count once per session; count the whole batch, since rows
+            # written by an attempt whose response was lost are skipped by the upsert
+            counts: Dict[str, int] = {}
+            for row in batch:
+                counts[row["session_id"]] = counts.get(row["session_id"], 0) + 1
             
-            if result.data:
-                # Update transcript count in session
-                await self.update_session_transcript_count(session_id)
-                logger.debug(f"Saved transcript for session {session_id}")
-                return True
+            for session_id, count in counts.items():
+                await self.update_session_transcript_count(session_id, count)
             
-            return False
+            logger.debug(f"Saved {len(batch)} transcripts")
+            return True
             
         except Exception as e:
-            logger.error(f"Error saving transcript: {e}")
+            logger.error(f"Error saving transcripts: {e}")
             return False
 
-    async def update_session_transcript_count(self, session_id: str):
-        """Update transcript count for a session"""
+    async def update_session_transcript_count(self, session_id: str, increment: int = 1):
+        """Atomically increment transcript count for a session"""
         try:
-            # Get current count
-            result = self.supabase.table("room_sessions").select("transcript_count").eq("id", session_id).execute()
-            
-            if result.data:
-                current_count = result.data[0]["transcript_count"]
-                new_count = current_count + 1
-                
-                # Update count
-                self.supabase.table("room_sessions").update({
-                    "transcript_count": new_count,
-                    "updated_at": datetime.utcnow().isoformat()
-                }).eq("id", session_id).execute()
+            # Not idempotent: only retried when the request never reached the database
+            await self._execute_with_retry(self.supabase.rpc("increment_transcript_count", {
+                "sid": session_id,
+                "delta": increment
+            }), idempotent=False)
                 
         except Exception as e:
             logger.error(f"Error updating transcript count: {e}")
 
-    async def send_to_websocket_logger(self, room_id: int, mosque_id: int, arabic_text: str, translation: str):
-        """Send translation data to the WebSocket logger"""
-        try:
-            message = {
-                "type": "translation",
-                "room_id": room_id,
-                "mosque_id": mosque_id,
-                "data": {
-                    "arabic": arabic_text,
-                    "translation": translation
-                },
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-            if self.websocket_logger_url:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        f"{self.websocket_logger_url}/functions/v1/websocket-logger",
-                        json=message,
-                        timeout=5.0
-                    )
-                    
-                    if response.status_code == 200:
-                        logger.debug("Successfully sent to WebSocket logger")
-                    else:
-                        logger.warning(f"WebSocket logger responded with {response.status_code}")
-            else:
-                logger.debug("WebSocket logger URL not configured")
-                
-        except Exception as e:
-            logger.debug(f"Could not send to WebSocket logger: {e}")
-
     async def get_room_languages(self, room_id: int) -> tuple[str, str]:
         """Get transcription and translation languages for a room"""
+        cached = self._room_languages_cache.get(room_id)
+        if cached is not None:
+            return cached
+        
         try:
-            result = self.supabase.table("rooms").select("transcription_language, translation__language").eq("id", room_id).execute()
+            # Defaults for unset languages are applied by the room_languages function
+            result = await self._execute(self.supabase.rpc("room_languages", {"rid": room_id}))
             
             if result.data:
-                room_data = result.data[0]
-                transcription_lang = room_data.get("transcription_language", "ar")
-                translation_lang = room_data.get("translation__language", "en")
-                return transcription_lang, translation_lang
+                languages = (result.data[0]["src"], result.data[0]["tgt"])
+            else:
+                languages = ("ar", "en")  # Room not found
             
-            return "ar", "en"  # Default values
+            self._room_languages_cache[room_id] = languages
+            return languages
             
         except Exception as e:
             logger.error(f"Error fetching room languages: {e}")
@@ -212,17 +313,24 @@ class SupabaseService:
 
     async def is_session_logging_enabled(self, room_id: int) -> bool:
         """Check if logging is enabled for the current session"""
+        cached = self._logging_enabled_cache.get(room_id)
+        if cached is not None:
+            return cached
+        
         try:
             active_session = await self.get_active_session(room_id)
-            if active_session:
-                return active_session.get("logging_enabled", False)
-            return False
+            enabled = bool(active_session.get("logging_enabled", False)) if active_session else False
+            self._logging_enabled_cache[room_id] = enabled
+            return enabled
             
         except Exception as e:
+            # Not cached, so the next transcript checks again
             logger.error(f"Error checking logging status: {e}")
             return False
 
-    async def update_participant_count(self, room_id: int, mosque_id: int, count: int):
+    async def update_participant_count(
+        self, room_id: int, mosque_id: int, count: int, http_client: httpx.AsyncClient
+    ):
         """Send participant count update to admin panel"""
         try:
             message = {
@@ -230,16 +338,14 @@ class SupabaseService:
                 "room_id": room_id,
                 "mosque_id": mosque_id,
                 "data": {"count": count},
-                "timestamp": datetime.utcnow().isoformat()
+                "timestamp": utc_timestamp()
             }
             
             if self.websocket_logger_url:
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        f"{self.websocket_logger_url}/functions/v1/websocket-logger",
-                        json=message,
-                        timeout=5.0
-                    )
+                await http_client.post(
+                    f"{self.websocket_logger_url}/functions/v1/websocket-logger",
+                    json=message
+                )
                     
         except Exception as e:
             logger.debug(f"Could not send participant update: {e}")
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# supabase_service creates its client at import time; give it placeholder credentials
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_SERVICE_ROLE_KEY", "header.payload.signature")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
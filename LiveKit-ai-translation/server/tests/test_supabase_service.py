@@ -0,0 +1,95 @@
+import asyncio
+
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+
+import supabase_service
+from supabase_service import is_transient_error
+
+
+def api_error(code):
+    return APIError({"message": "error", "code": code, "hint": None, "details": None})
+
+
+@pytest.mark.parametrize("error", [
+    httpx.ConnectError("connection refused"),
+    httpx.ReadTimeout("timed out"),
+])
+def test_transport_errors_are_transient(error):
+    assert is_transient_error(error)
+
+
+@pytest.mark.parametrize("code", ["PGRST000", "PGRST001", "PGRST002", "PGRST003"])
+def test_postgrest_connection_codes_are_transient(code):
+    assert is_transient_error(api_error(code))
+
+
+@pytest.mark.parametrize("code", ["429", "500", "502", "503", "504", 503])
+def test_http_status_fallback_codes_are_transient(code):
+    assert is_transient_error(api_error(code))
+
+
+def test_gateway_errors_without_code_are_transient():
+    assert is_transient_error(api_error(None))
+
+
+@pytest.mark.parametrize("code", ["23505", "PGRST116", "PGRST204", "400", "404"])
+def test_query_errors_are_not_transient(code):
+    assert not is_transient_error(api_error(code))
+
+
+def test_other_exceptions_are_not_transient():
+    assert not is_transient_error(ValueError("bad input"))
+
+
+def test_execute_with_retry_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(supabase_service, "RETRY_BASE_DELAY", 0)
+    service = supabase_service.supabase_service
+    calls = []
+
+    async def fake_execute(query):
+        calls.append(query)
+        if len(calls) < 3:
+            raise api_error("PGRST001")
+        return "ok"
+
+    monkeypatch.setattr(service, "_execute", fake_execute)
+
+    assert asyncio.run(service._execute_with_retry("query")) == "ok"
+    assert len(calls) == 3
+
+
+def test_execute_with_retry_raises_permanent_errors(monkeypatch):
+    service = supabase_service.supabase_service
+    calls = []
+
+    async def fake_execute(query):
+        calls.append(query)
+        raise api_error("23505")
+
+    monkeypatch.setattr(service, "_execute", fake_execute)
+
+    with pytest.raises(APIError):
+        asyncio.run(service._execute_with_retry("query"))
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("error", [
+    httpx.ConnectError("connection refused"),
+    httpx.ConnectTimeout("timed out"),
+    httpx.PoolTimeout("no connection available"),
+    api_error("PGRST001"),
+])
+def test_non_idempotent_requests_retry_when_never_run(error):
+    assert is_transient_error(error, idempotent=False)
+
+
+@pytest.mark.parametrize("error", [
+    httpx.ReadTimeout("timed out"),
+    httpx.RemoteProtocolError("connection closed"),
+    api_error("503"),
+    api_error(None),
+])
+def test_non_idempotent_requests_do_not_retry_ambiguous_failures(error):
+    assert not is_transient_error(error, idempotent=False)